@@ -1,17 +1,36 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 import os
 import sys
 import asyncio
 import threading
+import contextvars
+import functools
 from telethon.sync import TelegramClient
 from telethon import events
+from telethon.extensions import BinaryReader
 from telethon.tl.functions.channels import CreateChannelRequest, GetFullChannelRequest, JoinChannelRequest
 from telethon.tl.functions.messages import ExportChatInviteRequest
 from telethon.tl.types import InputPeerChannel
-from telethon.errors.rpcerrorlist import PeerFloodError, UserPrivacyRestrictedError
+from telethon.errors.rpcerrorlist import PeerFloodError, UserPrivacyRestrictedError, FloodWaitError
 from dotenv import load_dotenv
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import hashlib
+import hmac
+import socket
+import json
+import math
+import struct
 import time
 import re
+import zlib
+
+try:
+    import orjson  # Optional fast JSON encoder
+except ImportError:
+    orjson = None
 
 # Load environment variables
 load_dotenv()
@@ -31,14 +50,771 @@ SESSION_NAME = 'telegram_session'
 message_listener_client = None
 active_listeners = {}  # Dictionary to track active listeners: {group_id: callback_url}
 listener_running = False
-message_history = {}  # Dictionary to store message history: {group_id: [messages]}
+message_history = {}  # Dictionary to store message history: {group_id: OrderedDict of {message_id: pre-serialized JSON bytes}}
+unscoped_message_index = {}  # Dictionary to find the group of non-channel messages: {message_id: group_id}
+group_rules = {}  # Dictionary to store compiled message rules: {group_id: GroupRuleSet}
+group_stats = {}  # Dictionary to store streaming message statistics: {group_id: GroupStats}
+joined_group_ids = set()  # Groups/channels the account is known to be a member of
+group_entity_cache = {}  # Resolved group entities: {"@username" or invite link: entity}
+
+# Walk the account's dialogs when the listener starts so entities and access
+# hashes are cached before the first requests arrive
+WARMUP_DIALOGS = os.getenv('WARMUP_DIALOGS', '').lower() in ('1', 'true', 'yes')
+warmup_state = {
+    "state": "pending" if WARMUP_DIALOGS else "disabled",
+    "dialogs": 0,
+    "duration_ms": None,
+    "error": None
+}
+warmup_task = None
+warmup_lock = threading.Lock()
+listener_starting = False  # Set while a local listener thread comes up, so it runs the warm-up
+
+# Number of messages kept in memory per group
+MESSAGE_HISTORY_LIMIT = 100
+
+# Listener daemon Unix socket. When set, a single daemon started with
+# `python telegram_api.py --listener-daemon` owns the update stream and the
+# message store, and web workers query it over this socket instead of
+# starting their own listener
+LISTENER_SOCKET = os.getenv('LISTENER_SOCKET')
+LISTENER_TIMEOUT_SECONDS = float(os.getenv('LISTENER_TIMEOUT_SECONDS', '10'))
+LISTENER_MAX_REQUEST_BYTES = 16 * 1024 * 1024
+is_listener_daemon = False
+
+# Request tracing: spans are always collected, and reported in a Server-Timing
+# response header when TRACE_REQUESTS is set or an admin request sends X-Debug-Trace
+TRACE_REQUESTS = os.getenv('TRACE_REQUESTS', '').lower() in ('1', 'true', 'yes')
+
+# Admin endpoints (profiling) are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+
+# Trace of the request being handled in the current thread/task
+request_trace = contextvars.ContextVar('request_trace', default=None)
+
+# Admission lane held by the request being handled in the current thread/task
+held_admission_lane = contextvars.ContextVar('held_admission_lane', default=None)
+
+# Threads to sample when profiling
+active_request_threads = set()
+listener_thread_id = None
+active_profiler = None
+profiler_lock = threading.Lock()
+
+# Admission control: maximum in-flight requests talking to Telegram and
+# maximum queued requests per lane. Reads resolve groups and serve history,
+# writes send messages, join and create groups, exports stream full histories.
+# Joins from read routes (private invite links) take a write slot of their own.
+ADMISSION_WAIT_SECONDS = float(os.getenv('ADMISSION_WAIT_SECONDS', '5'))
+ADMISSION_LIMITS = {
+    'read': (int(os.getenv('READ_CONCURRENCY', '8')), int(os.getenv('READ_QUEUE_SIZE', '32'))),
+    'write': (int(os.getenv('WRITE_CONCURRENCY', '2')), int(os.getenv('WRITE_QUEUE_SIZE', '8'))),
+    'export': (int(os.getenv('EXPORT_CONCURRENCY', '2')), int(os.getenv('EXPORT_QUEUE_SIZE', '2'))),
+}
+
+class ListenerDaemonError(Exception):
+    """Raised when the listener daemon cannot be reached or rejects a call"""
+
+class AdmissionRejectedError(Exception):
+    """Raised when an admission lane is saturated"""
+    
+    def __init__(self, lane_name, retry_after):
+        super().__init__(f"Too many concurrent {lane_name} requests, try again later")
+        self.lane_name = lane_name
+        self.retry_after = retry_after
+
+def dumps_json_bytes(obj):
+    """
+    Serialize an object to compact UTF-8 JSON bytes, using orjson when available
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def new_message_history():
+    """
+    Create an empty message history buffer for a group, indexed by message id
+    """
+    return OrderedDict()
+
+def store_message_record(group_id, message_id, record, unscoped=False):
+    """
+    Append a serialized message to a group's history, dropping the oldest beyond the limit
+    
+    Deletions in non-channel groups arrive without a chat id, so those messages
+    are also indexed by id alone (message ids are account-wide there).
+    """
+    history = message_history.get(group_id)
+    if history is None:
+        history = message_history[group_id] = new_message_history()
+    
+    history[message_id] = record
+    if unscoped:
+        unscoped_message_index[message_id] = group_id
+    
+    while len(history) > MESSAGE_HISTORY_LIMIT:
+        old_id, _ = history.popitem(last=False)
+        if unscoped_message_index.get(old_id) == group_id:
+            del unscoped_message_index[old_id]
+
+def update_message_record(group_id, message_id, record):
+    """
+    Replace a stored message in place, returning False if it is not stored
+    """
+    history = message_history.get(group_id)
+    if history is None or message_id not in history:
+        return False
+    
+    # Assigning an existing key keeps the message's position
+    history[message_id] = record
+    return True
+
+def delete_message_records(group_id, message_ids):
+    """
+    Remove stored messages, returning how many were removed
+    
+    When group_id is None the messages are looked up in the id-only index.
+    """
+    removed = 0
+    for message_id in message_ids:
+        owner_id = group_id
+        if owner_id is None:
+            owner_id = unscoped_message_index.get(message_id)
+            if owner_id is None:
+                continue
+        
+        history = message_history.get(owner_id)
+        if history is not None and history.pop(message_id, None) is not None:
+            removed += 1
+        if unscoped_message_index.get(message_id) == owner_id:
+            del unscoped_message_index[message_id]
+    
+    return removed
+
+def build_group_messages_response(group_info, messages_payload):
+    """
+    Assemble the /get-group-messages JSON body from an already serialized messages array
+    """
+    return b''.join((
+        b'{"success":true,"group":',
+        dumps_json_bytes(group_info),
+        b',"messages":',
+        messages_payload,
+        b'}'
+    ))
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton reporting every keyword found in a text, overlapping or not
+    """
+    
+    def __init__(self, keywords):
+        self.transitions = [{}]  # {state: {character: next state}}
+        self.fail = [0]
+        self.outputs = [set()]  # Keywords ending at each state, including via fail links
+        
+        for keyword in keywords:
+            state = 0
+            for character in keyword:
+                next_state = self.transitions[state].get(character)
+                if next_state is None:
+                    next_state = len(self.transitions)
+                    self.transitions[state][character] = next_state
+                    self.transitions.append({})
+                    self.fail.append(0)
+                    self.outputs.append(set())
+                state = next_state
+            self.outputs[state].add(keyword)
+        
+        # Breadth-first pass to link every state to its longest proper suffix state
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for character, next_state in self.transitions[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and character not in self.transitions[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.transitions[fallback].get(character, 0)
+                if self.fail[next_state] == next_state:
+                    self.fail[next_state] = 0
+                self.outputs[next_state] |= self.outputs[self.fail[next_state]]
+    
+    def find(self, text):
+        found = set()
+        state = 0
+        for character in text:
+            while state and character not in self.transitions[state]:
+                state = self.fail[state]
+            state = self.transitions[state].get(character, 0)
+            if self.outputs[state]:
+                found |= self.outputs[state]
+        return found
+
+class GroupRuleSet:
+    """
+    Message rules of a group compiled into shared matchers
+    
+    All keywords of the group go into one Aho-Corasick automaton, so a message's
+    text is scanned once for keywords no matter how many rules exist. Regexes
+    without groups or inline flags are also joined into one alternation that
+    gates them: they are only searched one by one when the gate finds a match.
+    Other regexes are searched on every message.
+    """
+    
+    def __init__(self, rules, only_matches):
+        self.only_matches = only_matches
+        self.rules = rules  # {rule name: compiled rule from compile_group_rules}
+        self.textless_rules = []  # Rules without keywords or regexes
+        self.keyword_rules = {}  # {keyword: [rule names]}
+        self.regex_rules = {}  # {compiled regex: [rule names]}
+        
+        for name, rule in rules.items():
+            if not rule['keywords'] and rule['regex'] is None:
+                self.textless_rules.append(name)
+            for keyword in rule['keywords']:
+                self.keyword_rules.setdefault(keyword, []).append(name)
+            if rule['regex'] is not None:
+                self.regex_rules.setdefault(rule['regex'], []).append(name)
+        
+        self.automaton = KeywordAutomaton(self.keyword_rules) if self.keyword_rules else None
+        
+        # Groups and inline global flags change meaning once spliced into a
+        # larger pattern, so only plain regexes are put behind the gate
+        self.gated_regexes = []
+        self.ungated_regexes = []
+        for regex in self.regex_rules:
+            if regex.groups == 0 and regex.flags == re.UNICODE:
+                self.gated_regexes.append(regex)
+            else:
+                self.ungated_regexes.append(regex)
+        
+        self.regex_gate = None
+        if len(self.gated_regexes) > 1:
+            try:
+                self.regex_gate = re.compile('|'.join(f"(?:{regex.pattern})" for regex in self.gated_regexes))
+            except re.error:
+                self.ungated_regexes.extend(self.gated_regexes)
+                self.gated_regexes = []
+        elif self.gated_regexes:
+            self.ungated_regexes.extend(self.gated_regexes)
+            self.gated_regexes = []
+    
+    def match(self, text, sender_id, has_media):
+        """
+        Return the names of the rules matching a message
+        """
+        keyword_matched = set()
+        regex_matched = set()
+        if text:
+            if self.automaton is not None:
+                for keyword in self.automaton.find(text.lower()):
+                    keyword_matched.update(self.keyword_rules[keyword])
+            regexes = self.ungated_regexes
+            if self.regex_gate is not None and self.regex_gate.search(text):
+                regexes = self.ungated_regexes + self.gated_regexes
+            for regex in regexes:
+                if regex.search(text):
+                    regex_matched.update(self.regex_rules[regex])
+        
+        matched = []
+        for name in keyword_matched | regex_matched | set(self.textless_rules):
+            rule = self.rules[name]
+            if rule['keywords'] and name not in keyword_matched:
+                continue
+            if rule['regex'] is not None and name not in regex_matched:
+                continue
+            if rule['sender_ids'] is not None and sender_id not in rule['sender_ids']:
+                continue
+            if rule['has_media'] is not None and rule['has_media'] != has_media:
+                continue
+            matched.append(name)
+        
+        return sorted(matched)
+
+def compile_group_rules(rules, only_matches=False):
+    """
+    Validate rule definitions and compile them into a GroupRuleSet
+    
+    Each rule may define keywords (case-insensitive, any of them must occur),
+    a regex, sender_ids (any of them) and has_media. A rule matches when all
+    of its defined conditions hold.
+    """
+    if not isinstance(rules, list):
+        return None, "rules must be a list"
+    
+    compiled_rules = {}
+    for index, rule in enumerate(rules):
+        if not isinstance(rule, dict):
+            return None, f"Rule {index} must be an object"
+        
+        name = str(rule.get('name') or f"rule_{index + 1}")
+        if name in compiled_rules:
+            return None, f"Duplicate rule name: {name}"
+        
+        keywords = rule.get('keywords', [])
+        if not isinstance(keywords, list):
+            return None, f"keywords of rule {name} must be a list"
+        
+        # Lowercased so matching is case-insensitive and rules share keywords
+        keywords = {str(keyword).lower() for keyword in keywords if str(keyword)}
+        
+        regex = rule.get('regex')
+        if regex is not None and not isinstance(regex, str):
+            return None, f"regex of rule {name} must be a string"
+        if regex:
+            try:
+                regex = re.compile(regex)
+            except re.error as e:
+                return None, f"Invalid regex in rule {name}: {e}"
+        else:
+            regex = None
+        
+        sender_ids = rule.get('sender_ids')
+        if sender_ids is not None:
+            if not isinstance(sender_ids, list):
+                return None, f"sender_ids of rule {name} must be a list"
+            if not sender_ids:
+                return None, f"sender_ids of rule {name} must not be empty"
+            try:
+                sender_ids = {int(sender_id) for sender_id in sender_ids}
+            except (TypeError, ValueError):
+                return None, f"sender_ids of rule {name} must be numeric"
+        
+        has_media = rule.get('has_media')
+        if has_media is not None and not isinstance(has_media, bool):
+            return None, f"has_media of rule {name} must be true or false"
+        
+        if not keywords and regex is None and sender_ids is None and has_media is None:
+            return None, f"Rule {name} has no conditions"
+        
+        compiled_rules[name] = {
+            "keywords": keywords,
+            "regex": regex,
+            "sender_ids": sender_ids,
+            "has_media": has_media
+        }
+    
+    return GroupRuleSet(compiled_rules, bool(only_matches)), None
+
+class RollingRateCounter:
+    """
+    Message counts over a rolling time window kept in fixed per-bucket slots
+    """
+    
+    def __init__(self, window_seconds=3600, bucket_seconds=60):
+        self.bucket_seconds = bucket_seconds
+        self.bucket_count = window_seconds // bucket_seconds
+        self.counts = [0] * self.bucket_count
+        self.bucket_ids = [-1] * self.bucket_count  # Absolute bucket number held by each slot
+    
+    def add(self, timestamp):
+        bucket_id = int(timestamp) // self.bucket_seconds
+        slot = bucket_id % self.bucket_count
+        if self.bucket_ids[slot] != bucket_id:
+            if bucket_id < self.bucket_ids[slot]:
+                # Older than the window, nothing to count
+                return
+            # The slot still holds an older bucket, reuse it
+            self.bucket_ids[slot] = bucket_id
+            self.counts[slot] = 0
+        self.counts[slot] += 1
+    
+    def count(self, seconds, now=None):
+        """
+        Number of messages in the last `seconds` (rounded up to whole buckets)
+        """
+        now = time.time() if now is None else now
+        current = int(now) // self.bucket_seconds
+        buckets = min(self.bucket_count, max(1, math.ceil(seconds / self.bucket_seconds)))
+        oldest = current - buckets + 1
+        return sum(count for count, bucket_id in zip(self.counts, self.bucket_ids)
+                   if oldest <= bucket_id <= current)
+
+class SpaceSavingTopK:
+    """
+    Approximate top-K heavy hitters using the Space-Saving algorithm
+    """
+    
+    def __init__(self, capacity=20):
+        self.capacity = capacity
+        self.entries = {}  # {key: [count, overestimation, label]}
+    
+    def add(self, key, label=None):
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry[0] += 1
+            if label:
+                entry[2] = label
+            return
+        
+        if len(self.entries) < self.capacity:
+            self.entries[key] = [1, 0, label]
+            return
+        
+        # Replace the smallest counter, inheriting its count as the error bound
+        min_key = min(self.entries, key=lambda k: self.entries[k][0])
+        min_count = self.entries.pop(min_key)[0]
+        self.entries[key] = [min_count + 1, min_count, label]
+    
+    def top(self, k=10):
+        ranked = sorted(self.entries.items(), key=lambda item: item[1][0], reverse=True)[:k]
+        return [{"id": key, "label": label, "count": count, "max_error": error}
+                for key, (count, error, label) in ranked]
+
+class HyperLogLog:
+    """
+    Cardinality estimator with a fixed number of registers
+    """
+    
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.register_count = 1 << precision
+        self.registers = bytearray(self.register_count)
+        self.alpha = 0.7213 / (1 + 1.079 / self.register_count)
+    
+    def add(self, value):
+        hashed = int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+        index = hashed >> (64 - self.precision)
+        remaining = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+    
+    def estimate(self):
+        estimate = self.alpha * self.register_count ** 2 / sum(2.0 ** -register for register in self.registers)
+        if estimate <= 2.5 * self.register_count:
+            # Small range correction
+            zeros = self.registers.count(0)
+            if zeros:
+                estimate = self.register_count * math.log(self.register_count / zeros)
+        return int(round(estimate))
+
+class GroupStats:
+    """
+    Streaming message statistics of a listened group with bounded memory
+    """
+    
+    def __init__(self):
+        self.total_messages = 0
+        self.media_messages = 0
+        self.first_message_at = None
+        self.last_message_at = None
+        self.rate = RollingRateCounter()
+        self.top_senders = SpaceSavingTopK()
+        self.unique_senders = HyperLogLog()
+    
+    def add(self, timestamp, sender_id, sender_label, has_media):
+        self.total_messages += 1
+        if has_media:
+            self.media_messages += 1
+        if self.first_message_at is None or timestamp < self.first_message_at:
+            self.first_message_at = timestamp
+        if self.last_message_at is None or timestamp > self.last_message_at:
+            self.last_message_at = timestamp
+        self.rate.add(timestamp)
+        if sender_id is not None:
+            self.top_senders.add(sender_id, sender_label)
+            self.unique_senders.add(sender_id)
+    
+    @staticmethod
+    def _isoformat(timestamp):
+        if timestamp is None:
+            return None
+        return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+    
+    def summary(self):
+        now = time.time()
+        last_hour = self.rate.count(3600, now)
+        return {
+            "total_messages": self.total_messages,
+            "media_messages": self.media_messages,
+            "first_message_at": self._isoformat(self.first_message_at),
+            "last_message_at": self._isoformat(self.last_message_at),
+            "messages_last_minute": self.rate.count(60, now),
+            "messages_last_5_minutes": self.rate.count(300, now),
+            "messages_last_hour": last_hour,
+            "messages_per_minute_last_hour": round(last_hour / 60, 2),
+            "unique_senders_estimate": self.unique_senders.estimate(),
+            "top_senders": self.top_senders.top()
+        }
+
+def build_message_info(message, sender):
+    """
+    Build the stored/exported representation of a message
+    """
+    # Extract sender info
+    sender_info = {
+        "id": getattr(sender, 'id', None),
+        "first_name": getattr(sender, 'first_name', None),
+        "last_name": getattr(sender, 'last_name', None),
+        "username": getattr(sender, 'username', None),
+        "phone": getattr(sender, 'phone', None)
+    }
+    
+    return {
+        "id": message.id,
+        "text": message.text,
+        "date": message.date.isoformat(),
+        "sender": sender_info
+    }
+
+class RequestTrace:
+    """
+    Timing spans recorded while handling one API request
+    """
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []  # [(name, duration in ms)]
+    
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+    
+    def server_timing(self):
+        """
+        Format the spans as a Server-Timing header value
+        """
+        entries = [f"total;dur={self.total_ms():.1f}"]
+        for index, (name, duration) in enumerate(self.spans):
+            entries.append(f'{index};desc="{name}";dur={duration:.1f}')
+        return ', '.join(entries)
+    
+    def log_line(self):
+        spans = ' '.join(f"{name}={duration:.1f}ms" for name, duration in self.spans)
+        return f"total={self.total_ms():.1f}ms {spans}".strip()
+
+@contextmanager
+def trace_span(name):
+    """
+    Record the duration of a block in the current request trace, if any
+    """
+    trace = request_trace.get()
+    if trace is None:
+        yield
+        return
+    
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.spans.append((name, (time.perf_counter() - started) * 1000))
+
+class TracedTelegramClient(TelegramClient):
+    """
+    Telegram client that records a trace span for every RPC it sends
+    """
+    
+    async def __call__(self, request, *args, **kwargs):
+        with trace_span(f"rpc.{type(request).__name__}"):
+            return await super().__call__(request, *args, **kwargs)
+
+class SamplingProfiler:
+    """
+    Sample the stacks of the request or listener threads for a number of seconds
+    and dump them in folded (flame graph) format
+    """
+    
+    def __init__(self, target, seconds, interval=0.005):
+        self.target = target
+        self.seconds = seconds
+        self.interval = interval
+        self.output_path = os.path.join(PROFILE_DIR, f"profile-{target}-{int(time.time())}.folded")
+        self.samples = 0
+    
+    def thread_ids(self):
+        if self.target == 'listener':
+            return {listener_thread_id} if listener_thread_id else set()
+        return set(active_request_threads)
+    
+    @staticmethod
+    def fold(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+    
+    def run(self):
+        global active_profiler
+        
+        stacks = Counter()
+        ends_at = time.monotonic() + self.seconds
+        try:
+            while time.monotonic() < ends_at:
+                frames = sys._current_frames()
+                for thread_id in self.thread_ids():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[self.fold(frame)] += 1
+                        self.samples += 1
+                del frames
+                time.sleep(self.interval)
+            
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with open(self.output_path, 'w') as profile_file:
+                for stack, count in stacks.most_common():
+                    profile_file.write(f"{stack} {count}\n")
+            print(f"Profile of {self.target} written to {self.output_path} ({self.samples} samples)")
+        except Exception as e:
+            print(f"Error while profiling {self.target}: {e}")
+        finally:
+            with profiler_lock:
+                active_profiler = None
+    
+    def start(self):
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+def start_sampling_profiler(target, seconds):
+    """
+    Start profiling the request or listener threads in the background
+    """
+    global active_profiler
+    
+    with profiler_lock:
+        if active_profiler is not None:
+            return None, f"A profile of {active_profiler.target} is already running"
+        
+        profiler = active_profiler = SamplingProfiler(target, seconds)
+    
+    profiler.start()
+    return profiler.output_path, None
+
+class AdmissionLane:
+    """
+    Bounded number of in-flight requests with a bounded wait queue
+    """
+    
+    def __init__(self, name, capacity, max_waiting, wait_seconds):
+        self.name = name
+        self.capacity = capacity
+        self.max_waiting = max_waiting
+        self.wait_seconds = wait_seconds
+        self.in_flight = 0
+        self.waiting = 0
+        self.average_hold = 1.0  # Moving average of seconds a slot is held
+        self.condition = threading.Condition()
+    
+    def acquire(self):
+        """
+        Take a slot, waiting in the queue if needed. Returns False when rejected.
+        """
+        with self.condition:
+            if self.in_flight < self.capacity and not self.waiting:
+                self.in_flight += 1
+                return True
+            
+            # Fast-fail when the queue is full
+            if self.waiting >= self.max_waiting:
+                return False
+            
+            self.waiting += 1
+            try:
+                deadline = time.monotonic() + self.wait_seconds
+                while self.in_flight >= self.capacity:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self.condition.wait(remaining)
+                self.in_flight += 1
+                return True
+            finally:
+                self.waiting -= 1
+    
+    def release(self, held_seconds):
+        with self.condition:
+            self.in_flight -= 1
+            self.average_hold = 0.8 * self.average_hold + 0.2 * held_seconds
+            self.condition.notify()
+    
+    def retry_after(self):
+        """
+        Seconds until a slot is likely to be free, for the Retry-After header
+        """
+        with self.condition:
+            return max(1, math.ceil(self.average_hold * (self.waiting + 1) / self.capacity))
+
+admission_lanes = {
+    name: AdmissionLane(name, capacity, max_waiting, ADMISSION_WAIT_SECONDS)
+    for name, (capacity, max_waiting) in ADMISSION_LIMITS.items()
+}
+
+# Threads the listener daemon blocks in while web workers wait for a slot
+admission_executor = ThreadPoolExecutor(
+    max_workers=sum(capacity + max_waiting for capacity, max_waiting in ADMISSION_LIMITS.values()),
+    thread_name_prefix='admission'
+)
+
+def acquire_admission(lane_name):
+    """
+    Take a slot of an admission lane, waiting in its queue if needed
+    
+    With a listener daemon the slot is taken from the daemon's lanes, so the
+    limits hold across all web workers. Returns a function releasing the
+    slot, or raises AdmissionRejectedError when the lane is saturated.
+    """
+    if use_listener_daemon():
+        return acquire_daemon_admission(lane_name)
+    
+    lane = admission_lanes[lane_name]
+    if not lane.acquire():
+        raise AdmissionRejectedError(lane_name, lane.retry_after())
+    
+    started = time.monotonic()
+    
+    def release():
+        lane.release(time.monotonic() - started)
+    
+    return release
+
+def acquire_daemon_admission(lane_name):
+    """
+    Take a slot from the listener daemon's admission lanes
+    
+    The daemon holds the slot until the connection that asked for it is
+    closed, so a worker that dies mid-request cannot leak its slots.
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # The daemon answers once the request leaves the queue
+    connection.settimeout(ADMISSION_WAIT_SECONDS + LISTENER_TIMEOUT_SECONDS)
+    try:
+        connection.connect(LISTENER_SOCKET)
+        request_payload = dumps_json_bytes({"op": "admit", "args": {"lane": lane_name}})
+        connection.sendall(struct.pack('>I', len(request_payload)) + request_payload)
+        with connection.makefile('rb') as response_file:
+            header = response_file.read(5)
+            if len(header) < 5:
+                raise ConnectionError("connection closed by the listener daemon")
+            payload = response_file.read(struct.unpack('>I', header[1:])[0])
+    except OSError as e:
+        connection.close()
+        raise ListenerDaemonError(f"Listener daemon admission failed: {e}")
+    
+    if header[:1] == b'E':
+        connection.close()
+        raise ListenerDaemonError(payload.decode('utf-8'))
+    
+    result = json.loads(payload)
+    if not result['admitted']:
+        connection.close()
+        raise AdmissionRejectedError(lane_name, result['retry_after'])
+    
+    return connection.close
 
 async def create_client_for_request():
     """Create a new client for each request"""
-    client = TelegramClient(SESSION_NAME, API_ID, API_HASH)
-    await client.connect()
+    client = TracedTelegramClient(SESSION_NAME, API_ID, API_HASH)
+    with trace_span("connect"):
+        await client.connect()
     
-    if not await client.is_user_authorized():
+    with trace_span("is_user_authorized"):
+        authorized = await client.is_user_authorized()
+    
+    if not authorized:
         print("You need to authorize the Telegram client first.")
         print("Run the telegram_group_inviter.py script to authenticate.")
         await client.disconnect()
@@ -52,11 +828,12 @@ async def create_telegram_group(client, group_name, group_description):
     """
     try:
         # Create a supergroup (channel)
-        result = await client(CreateChannelRequest(
-            title=group_name,
-            about=group_description,
-            megagroup=True  # Set to True for supergroups
-        ))
+        with trace_span("create_group"):
+            result = await client(CreateChannelRequest(
+                title=group_name,
+                about=group_description,
+                megagroup=True  # Set to True for supergroups
+            ))
         
         channel = result.chats[0]
         return channel, None
@@ -71,7 +848,8 @@ async def get_invite_link(client, channel):
     try:
         # First approach: Try to get existing invite link
         try:
-            full_channel = await client(GetFullChannelRequest(channel))
+            with trace_span("invite_link.full_channel"):
+                full_channel = await client(GetFullChannelRequest(channel))
             if hasattr(full_channel.full_chat, 'invite_link') and full_channel.full_chat.invite_link:
                 return full_channel.full_chat.invite_link, None
         except Exception as e:
@@ -80,7 +858,8 @@ async def get_invite_link(client, channel):
         # Second approach: Try to create a new invite link
         try:
             # Create an invite link directly using the client method
-            link = await client.export_chat_invite_link(channel.id)
+            with trace_span("invite_link.export_client_method"):
+                link = await client.export_chat_invite_link(channel.id)
             if link:
                 return link, None
         except Exception as e:
@@ -90,7 +869,8 @@ async def get_invite_link(client, channel):
         try:
             # First convert channel to InputPeerChannel
             input_peer = InputPeerChannel(channel.id, channel.access_hash)
-            result = await client(ExportChatInviteRequest(peer=input_peer))
+            with trace_span("invite_link.export_request"):
+                result = await client(ExportChatInviteRequest(peer=input_peer))
             if result and hasattr(result, 'link'):
                 return result.link, None
         except Exception as e:
@@ -113,13 +893,15 @@ async def send_invites_to_phone_numbers(client, phone_numbers, invite_link, mess
         try:
             # Try to find the user by phone number
             try:
-                user = await client.get_entity(phone)
+                with trace_span("invite.resolve_user"):
+                    user = await client.get_entity(phone)
                 
                 # Send message with invite link
-                await client.send_message(
-                    user,
-                    f"{message_text}\n\n{invite_link}"
-                )
+                with trace_span("invite.send_message"):
+                    await client.send_message(
+                        user,
+                        f"{message_text}\n\n{invite_link}"
+                    )
                 
                 results.append({
                     "phone": phone,
@@ -158,6 +940,24 @@ async def send_invites_to_phone_numbers(client, phone_numbers, invite_link, mess
     
     return results
 
+async def join_group(client, group_entity):
+    """
+    Join a group, taking a write lane slot unless the request already holds one
+    """
+    release = None
+    if held_admission_lane.get() != 'write':
+        with trace_span("admission.write"):
+            release = await asyncio.to_thread(acquire_admission, 'write')
+    
+    try:
+        with trace_span("join_channel"):
+            await client(JoinChannelRequest(group_entity))
+    finally:
+        if release is not None:
+            release()
+    
+    await mark_group_joined(group_entity.id)
+
 async def extract_group_entity_from_link(client, invite_link):
     """
     Extract group entity from invite link
@@ -169,20 +969,36 @@ async def extract_group_entity_from_link(client, invite_link):
             if 't.me/' in invite_link:
                 if '+' in invite_link:
                     # This is a private group invite link (e.g., https://t.me/+abcdef123456)
+                    cache_key = invite_link.strip().rstrip('/')
+                    group_entity = await get_cached_group_entity(cache_key)
+                    if group_entity is None:
+                        with trace_span("resolve_entity"):
+                            group_entity = await client.get_entity(invite_link)
+                        await cache_group_entity(cache_key, group_entity)
+                    
                     # We need to join the group first
-                    group_entity = await client.get_entity(invite_link)
-                    await client(JoinChannelRequest(group_entity))
+                    if not await is_group_joined(group_entity.id):
+                        await join_group(client, group_entity)
                 else:
                     # This is a public group/channel (e.g., https://t.me/groupname)
                     username = invite_link.split('t.me/')[1].strip('/')
-                    group_entity = await client.get_entity(username)
+                    cache_key = f"@{username.lower()}"
+                    group_entity = await get_cached_group_entity(cache_key)
+                    if group_entity is None:
+                        with trace_span("resolve_entity"):
+                            group_entity = await client.get_entity(username)
+                        await cache_group_entity(cache_key, group_entity)
             else:
                 return None, "Invalid invite link format"
                 
             return group_entity, None
+        except AdmissionRejectedError:
+            raise
         except Exception as e:
             error_msg = f"Error joining group: {e}"
             return None, error_msg
+    except AdmissionRejectedError:
+        raise
     except Exception as e:
         error_msg = f"Error extracting group from link: {e}"
         return None, error_msg
@@ -196,13 +1012,42 @@ async def send_message_as_user_to_group(client, group_entity, sender_name, sende
         formatted_message = f"📱 **Mesaj: {sender_name} ({sender_phone})** 📱\n\n{message_text}"
         
         # Send the formatted message
-        await client.send_message(group_entity, formatted_message)
+        with trace_span("send_message"):
+            await client.send_message(group_entity, formatted_message)
         
         return True, None
     except Exception as e:
         error_msg = f"Error sending message to group: {e}"
         return False, error_msg
 
+async def iter_group_history_pages(client, group_entity, batch_size=100, cursor=None):
+    """
+    Yield a group's past messages from newest to oldest as NDJSON chunks, one per batch
+    
+    Only messages older than the `cursor` message id are exported, so an
+    interrupted export can be resumed from the id of the last received message.
+    """
+    offset_id = cursor or 0
+    
+    while True:
+        try:
+            with trace_span("history_page"):
+                batch = [message async for message in client.iter_messages(group_entity, limit=batch_size, offset_id=offset_id)]
+        except FloodWaitError as e:
+            # Wait as long as Telegram asks and retry the same page
+            print(f"Flood wait during history export, sleeping {e.seconds} seconds")
+            await asyncio.sleep(e.seconds)
+            continue
+        
+        if not batch:
+            return
+        
+        yield b''.join(dumps_json_bytes(build_message_info(message, message.sender)) + b'\n' for message in batch)
+        
+        offset_id = batch[-1].id
+        if len(batch) < batch_size:
+            return
+
 async def start_message_listener():
     """
     Start a background client that listens for messages in groups
@@ -219,7 +1064,7 @@ async def start_message_listener():
         listener_session = f"{SESSION_NAME}_listener_separate"
         
         # Initialize the message listener client with a separate session
-        message_listener_client = TelegramClient(listener_session, API_ID, API_HASH)
+        message_listener_client = TracedTelegramClient(listener_session, API_ID, API_HASH)
         await message_listener_client.connect()
         
         if not await message_listener_client.is_user_authorized():
@@ -246,33 +1091,37 @@ async def start_message_listener():
                     # Get message details
                     message = event.message
                     sender = await event.get_sender()
+                    # Channel posts and anonymous admins have no sender
+                    sender_id = getattr(sender, 'id', None)
                     
-                    # Extract sender info
-                    sender_info = {
-                        "id": sender.id,
-                        "first_name": getattr(sender, 'first_name', None),
-                        "last_name": getattr(sender, 'last_name', None),
-                        "username": getattr(sender, 'username', None),
-                        "phone": getattr(sender, 'phone', None)
-                    }
+                    # Update the group's statistics with every message, filtered or not
+                    if chat_id not in group_stats:
+                        group_stats[chat_id] = GroupStats()
+                    group_stats[chat_id].add(
+                        message.date.timestamp(),
+                        sender_id,
+                        getattr(sender, 'username', None),
+                        bool(message.media)
+                    )
                     
-                    # Create message info
-                    message_info = {
-                        "id": message.id,
-                        "text": message.text,
-                        "date": message.date.isoformat(),
-                        "sender": sender_info
-                    }
+                    # Evaluate the group's rules once for this message
+                    rule_set = group_rules.get(chat_id)
+                    matched_rules = []
+                    if rule_set:
+                        matched_rules = rule_set.match(message.text, sender_id, bool(message.media))
+                        if rule_set.only_matches and not matched_rules:
+                            return
                     
-                    # Add to message history
-                    if chat_id not in message_history:
-                        message_history[chat_id] = []
+                    # Create message info
+                    message_info = build_message_info(message, sender)
+                    sender_info = message_info["sender"]
                     
-                    message_history[chat_id].append(message_info)
+                    # Tag the message with the rules it matched
+                    if matched_rules:
+                        message_info["matched_rules"] = matched_rules
                     
-                    # Keep only the last 100 messages
-                    if len(message_history[chat_id]) > 100:
-                        message_history[chat_id] = message_history[chat_id][-100:]
+                    # Add to message history, serialized once so responses can reuse the bytes
+                    store_message_record(chat_id, message.id, dumps_json_bytes(message_info), unscoped=not event.is_channel)
                     
                     # Format sender name
                     sender_name = f"{sender_info['first_name'] or ''} {sender_info['last_name'] or ''}".strip()
@@ -293,6 +1142,9 @@ async def start_message_listener():
                         print(f"📱 Telefon: {sender_info['phone']}")
                     print(f"📝 Mesaj: {message.text}")
                     
+                    if matched_rules:
+                        print(f"🏷️ Eşleşen Kurallar: {', '.join(matched_rules)}")
+                    
                     # If message has media, show that as well
                     if message.media:
                         print(f"📷 Medya: {type(message.media).__name__}")
@@ -305,6 +1157,55 @@ async def start_message_listener():
             except Exception as e:
                 print(f"Error in message handler: {e}")
         
+        @message_listener_client.on(events.MessageEdited())
+        async def message_edited_handler(event):
+            """Update stored messages when they are edited"""
+            try:
+                chat = await event.get_chat()
+                chat_id = chat.id
+                message = event.message
+                
+                history = message_history.get(chat_id)
+                if chat_id not in active_listeners or history is None or message.id not in history:
+                    return
+                
+                sender = await event.get_sender()
+                
+                # Re-evaluate the group's rules against the new content
+                rule_set = group_rules.get(chat_id)
+                matched_rules = []
+                if rule_set:
+                    matched_rules = rule_set.match(message.text, getattr(sender, 'id', None), bool(message.media))
+                    if rule_set.only_matches and not matched_rules:
+                        delete_message_records(chat_id, [message.id])
+                        return
+                
+                message_info = build_message_info(message, sender)
+                if matched_rules:
+                    message_info["matched_rules"] = matched_rules
+                if message.edit_date:
+                    message_info["edit_date"] = message.edit_date.isoformat()
+                
+                update_message_record(chat_id, message.id, dumps_json_bytes(message_info))
+                print(f"✏️ Mesaj düzenlendi: {chat.title} (Mesaj ID: {message.id})")
+            except Exception as e:
+                print(f"Error in message edited handler: {e}")
+        
+        @message_listener_client.on(events.MessageDeleted())
+        async def message_deleted_handler(event):
+            """Remove deleted messages from the stored history"""
+            try:
+                # Channel deletions carry the channel id; others only carry message ids
+                channel_id = getattr(event.original_update, 'channel_id', None)
+                if channel_id is not None and channel_id not in active_listeners:
+                    return
+                
+                removed = delete_message_records(channel_id, event.deleted_ids)
+                if removed:
+                    print(f"🗑️ {removed} mesaj silindi")
+            except Exception as e:
+                print(f"Error in message deleted handler: {e}")
+        
         # Start the client
         listener_running = True
         print("Message listener started successfully")
@@ -314,6 +1215,86 @@ async def start_message_listener():
         print(f"Error starting message listener: {e}")
         return False
 
+async def warm_up_entity_caches(include_listener=True):
+    """
+    Walk the account's dialogs once with the request session (and the listener's)
+    
+    Telethon caches every entity (and its access hash) it sees in the session,
+    and groups with a username are kept in group_entity_cache, so later group
+    lookups skip the network. Dialogs are fetched in pages of 100 by iter_dialogs.
+    """
+    started = time.perf_counter()
+    
+    try:
+        clients = [message_listener_client] if include_listener and message_listener_client else []
+        request_client = await create_client_for_request()
+        if request_client:
+            # Listed last so its entities win in group_entity_cache
+            clients.append(request_client)
+        
+        dialog_ids = set()
+        try:
+            for client in clients:
+                async for dialog in client.iter_dialogs():
+                    dialog_ids.add(dialog.id)
+                    if dialog.is_group or dialog.is_channel:
+                        joined_group_ids.add(dialog.entity.id)
+                        username = getattr(dialog.entity, 'username', None)
+                        if username:
+                            group_entity_cache[f"@{username.lower()}"] = dialog.entity
+                warmup_state["dialogs"] = len(dialog_ids)
+        finally:
+            if request_client:
+                await request_client.disconnect()
+        
+        warmup_state["state"] = "done"
+        print(f"Entity cache warm-up finished: {warmup_state['dialogs']} dialogs")
+    except Exception as e:
+        warmup_state["state"] = "failed"
+        warmup_state["error"] = str(e)
+        print(f"Error warming up entity caches: {e}")
+    finally:
+        warmup_state["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+def claim_entity_cache_warmup():
+    """
+    Mark the warm-up as running, returning False if it is disabled or already claimed
+    """
+    with warmup_lock:
+        if not WARMUP_DIALOGS or warmup_state["state"] != "pending":
+            return False
+        warmup_state["state"] = "running"
+        return True
+
+def start_entity_cache_warmup():
+    """
+    Start the dialog warm-up in the listener loop if it is enabled
+    """
+    global warmup_task
+    
+    if claim_entity_cache_warmup():
+        warmup_task = asyncio.ensure_future(warm_up_entity_caches())
+
+def start_entity_cache_warmup_in_background():
+    """
+    Start the dialog warm-up in its own thread when no local listener has started it
+    
+    A listener that is still starting is left to run the warm-up itself, so
+    its session gets warmed too.
+    """
+    if use_listener_daemon() or listener_starting or not claim_entity_cache_warmup():
+        return
+    
+    def _thread_target():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(warm_up_entity_caches(include_listener=False))
+        loop.close()
+    
+    thread = threading.Thread(target=_thread_target)
+    thread.daemon = True
+    thread.start()
+
 async def stop_message_listener():
     """
     Stop the message listener client
@@ -334,8 +1315,6 @@ async def add_group_to_listeners(group_link):
     """
     Add a group to the active listeners
     """
-    global active_listeners
-    
     # Create a temporary client to get the group entity
     client = await create_client_for_request()
     if not client:
@@ -350,41 +1329,565 @@ async def add_group_to_listeners(group_link):
         
         # Add to active listeners
         group_id = group_entity.id
-        active_listeners[group_id] = group_link
-        
-        # Initialize message history for this group
-        if group_id not in message_history:
-            message_history[group_id] = []
+        await register_group_listener(group_id, group_link)
         
         await client.disconnect()
         return group_entity, None
+    except AdmissionRejectedError:
+        await client.disconnect()
+        raise
     except Exception as e:
         await client.disconnect()
         return None, f"Error adding group to listeners: {e}"
 
-def run_listener_in_background():
+def run_listener_in_background():
+    """
+    Run the message listener in a background thread
+    """
+    global listener_starting
+    
+    async def _run_listener():
+        global listener_starting
+        
+        try:
+            success = await start_message_listener()
+            if success:
+                start_entity_cache_warmup()
+        finally:
+            # Requests may take over the warm-up if the listener failed to start
+            listener_starting = False
+        
+        if success:
+            # Keep the client running indefinitely
+            while listener_running:
+                await asyncio.sleep(1)
+    
+    # Run in a new thread
+    def _thread_target():
+        global listener_thread_id
+        listener_thread_id = threading.get_ident()
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(_run_listener())
+    
+    listener_starting = True
+    thread = threading.Thread(target=_thread_target)
+    thread.daemon = True  # Thread will exit when the main program exits
+    thread.start()
+    return thread
+
+def use_listener_daemon():
+    """
+    Whether listener state lives in a separate listener daemon process
+    """
+    return bool(LISTENER_SOCKET) and not is_listener_daemon
+
+async def call_listener_daemon(op, **args):
+    """
+    Call an operation on the listener daemon over its Unix socket
+    
+    Requests are a 4 byte big-endian length followed by the JSON call. Each
+    response frame is a one byte kind (J: JSON, R: raw bytes, E: error)
+    followed by a 4 byte big-endian payload length and the payload.
+    """
+    with trace_span(f"listener_ipc.{op}"):
+        try:
+            return await asyncio.wait_for(_call_listener_daemon(op, args), LISTENER_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            raise ListenerDaemonError(f"Listener daemon did not answer {op} within {LISTENER_TIMEOUT_SECONDS} seconds")
+
+async def _call_listener_daemon(op, args):
+    try:
+        reader, writer = await asyncio.open_unix_connection(LISTENER_SOCKET)
+    except OSError as e:
+        raise ListenerDaemonError(f"Listener daemon is not reachable: {e}")
+    
+    try:
+        request_payload = dumps_json_bytes({"op": op, "args": args})
+        writer.write(struct.pack('>I', len(request_payload)) + request_payload)
+        await writer.drain()
+        header = await reader.readexactly(5)
+        kind = header[:1]
+        length = struct.unpack('>I', header[1:])[0]
+        payload = await reader.readexactly(length)
+    except (OSError, asyncio.IncompleteReadError) as e:
+        raise ListenerDaemonError(f"Listener daemon connection failed: {e}")
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+    
+    if kind == b'E':
+        raise ListenerDaemonError(payload.decode('utf-8'))
+    if kind == b'R':
+        return payload
+    return json.loads(payload)
+
+async def ensure_listener_running():
+    """
+    Make sure a message listener is running, starting one if needed
+    """
+    if use_listener_daemon():
+        status = await call_listener_daemon('status')
+        return status['running']
+    
+    if not listener_running:
+        # Start the listener in a background thread
+        run_listener_in_background()
+        # Wait for the listener to start
+        for _ in range(5):  # Wait up to 5 seconds
+            if listener_running:
+                break
+            await asyncio.sleep(1)
+    
+    return listener_running
+
+async def register_group_listener(group_id, group_link):
+    """
+    Start collecting messages for a group
+    """
+    if use_listener_daemon():
+        return await call_listener_daemon('register', group_id=group_id, group_link=group_link)
+    
+    active_listeners[group_id] = group_link
+    
+    # Initialize message history and statistics for this group
+    if group_id not in message_history:
+        message_history[group_id] = new_message_history()
+    if group_id not in group_stats:
+        group_stats[group_id] = GroupStats()
+    
+    return True
+
+async def is_group_listened(group_id):
+    """
+    Whether messages are being collected for a group
+    """
+    if use_listener_daemon():
+        return await call_listener_daemon('is_listened', group_id=group_id)
+    
+    return group_id in active_listeners
+
+async def get_group_messages_payload(group_id):
+    """
+    Get the stored messages of a group as a serialized JSON array
+    """
+    if use_listener_daemon():
+        return await call_listener_daemon('messages', group_id=group_id)
+    
+    history = message_history.get(group_id)
+    records = tuple(history.values()) if history else ()
+    return b'[' + b','.join(records) + b']'
+
+async def unregister_group_listener(group_id):
+    """
+    Stop collecting messages for a group and drop its history
+    """
+    if use_listener_daemon():
+        return await call_listener_daemon('unregister', group_id=group_id)
+    
+    if group_id not in active_listeners:
+        return False
+    
+    # Remove from active listeners
+    del active_listeners[group_id]
+    
+    # Clear message history, rules and statistics for this group
+    history = message_history.pop(group_id, None)
+    if history:
+        delete_message_records(group_id, list(history))
+    group_rules.pop(group_id, None)
+    group_stats.pop(group_id, None)
+    
+    # If no more active listeners, stop the listener (the daemon keeps running)
+    if not active_listeners and listener_running and not is_listener_daemon:
+        await stop_message_listener()
+    
+    return True
+
+async def set_group_rules(group_id, rules, only_matches=False):
+    """
+    Replace the message rules of a group, returning an error message if they are invalid
+    """
+    if use_listener_daemon():
+        return await call_listener_daemon('set_rules', group_id=group_id, rules=rules, only_matches=only_matches)
+    
+    rule_set, error = compile_group_rules(rules, only_matches)
+    if error:
+        return error
+    
+    if rule_set.rules:
+        group_rules[group_id] = rule_set
+    else:
+        group_rules.pop(group_id, None)
+    
+    return None
+
+async def get_group_stats(group_id):
+    """
+    Get the statistics summary of a listened group, or None if it is not listened
+    """
+    if use_listener_daemon():
+        return await call_listener_daemon('stats', group_id=group_id)
+    
+    if group_id not in active_listeners:
+        return None
+    
+    stats = group_stats.get(group_id)
+    if stats is None:
+        stats = group_stats[group_id] = GroupStats()
+    
+    return stats.summary()
+
+async def start_profiling(target, seconds):
+    """
+    Start sampling the listener or request threads, returning (output path, error)
+    """
+    if target == 'listener' and use_listener_daemon():
+        return await call_listener_daemon('profile', target=target, seconds=seconds)
+    
+    return start_sampling_profiler(target, seconds)
+
+async def listener_status():
+    """
+    Report the state of the local listener
+    """
+    return {"running": listener_running}
+
+async def get_cached_group_entity(key):
+    """
+    Look up a resolved group entity by "@username" or invite link
+    """
+    entity = group_entity_cache.get(key)
+    if entity is not None or not use_listener_daemon():
+        return entity
+    
+    try:
+        data = await call_listener_daemon('cached_entity', key=key)
+    except ListenerDaemonError as e:
+        print(f"Could not read entity cache from listener daemon: {e}")
+        return None
+    
+    if not data:
+        return None
+    
+    entity = BinaryReader(data).tgread_object()
+    group_entity_cache[key] = entity
+    return entity
+
+async def cache_group_entity(key, entity):
+    """
+    Remember a resolved group entity, sharing it with the listener daemon if there is one
+    """
+    group_entity_cache[key] = entity
+    if use_listener_daemon():
+        try:
+            await call_listener_daemon('cache_entity', key=key, entity=bytes(entity).hex())
+        except ListenerDaemonError as e:
+            print(f"Could not share entity with listener daemon: {e}")
+
+async def serve_cached_entity(key):
+    """
+    Serialize a cached entity for a web worker (empty when unknown)
+    """
+    entity = group_entity_cache.get(key)
+    return bytes(entity) if entity is not None else b''
+
+async def store_cached_entity(key, entity):
+    """
+    Store an entity serialized by a web worker
+    """
+    group_entity_cache[key] = BinaryReader(bytes.fromhex(entity)).tgread_object()
+    return True
+
+async def is_group_joined(group_id):
+    """
+    Whether the account is known to be a member of a group
+    """
+    if group_id in joined_group_ids or not use_listener_daemon():
+        return group_id in joined_group_ids
+    
+    try:
+        joined = await call_listener_daemon('is_joined', group_id=group_id)
+    except ListenerDaemonError as e:
+        print(f"Could not read joined groups from listener daemon: {e}")
+        return False
+    
+    if joined:
+        joined_group_ids.add(group_id)
+    return joined
+
+async def mark_group_joined(group_id):
+    """
+    Record that the account joined a group, in the listener daemon too if there is one
+    """
+    joined_group_ids.add(group_id)
+    if use_listener_daemon():
+        try:
+            await call_listener_daemon('mark_joined', group_id=group_id)
+        except ListenerDaemonError as e:
+            print(f"Could not report joined group to listener daemon: {e}")
+    return True
+
+async def get_health():
+    """
+    Report listener readiness, warm-up progress and listened groups
+    """
+    if use_listener_daemon():
+        return await call_listener_daemon('health')
+    
+    # Readiness only depends on the warm-up: the listener is stopped whenever
+    # no group is listened, which is a healthy state. A failed warm-up leaves
+    # the caches cold but the API usable, so it is reported without blocking readiness.
+    warming_up = warmup_state["state"] in ("pending", "running")
+    if warming_up:
+        status = "warming_up"
+    elif warmup_state["state"] == "failed":
+        status = "failed"
+    else:
+        status = "ok"
+    
+    return {
+        "status": status,
+        "ready": not warming_up,
+        "listener_running": listener_running,
+        "warmup": dict(warmup_state),
+        "groups": [
+            {"id": group_id, "link": group_link, "joined": group_id in joined_group_ids}
+            for group_id, group_link in list(active_listeners.items())
+        ]
+    }
+
+# Operations served by the listener daemon
+LISTENER_IPC_OPS = {
+    'status': listener_status,
+    'register': register_group_listener,
+    'is_listened': is_group_listened,
+    'messages': get_group_messages_payload,
+    'unregister': unregister_group_listener,
+    'set_rules': set_group_rules,
+    'stats': get_group_stats,
+    'profile': start_profiling,
+    'health': get_health,
+    'cached_entity': serve_cached_entity,
+    'cache_entity': store_cached_entity,
+    'is_joined': is_group_joined,
+    'mark_joined': mark_group_joined,
+}
+
+async def admit_worker_request(lane_name, held_slots):
+    """
+    Take an admission slot for a web worker, recording it on the worker's connection
+    """
+    lane = admission_lanes[lane_name]
+    loop = asyncio.get_running_loop()
+    admitted = await loop.run_in_executor(admission_executor, lane.acquire)
+    if admitted:
+        held_slots.append((lane, time.monotonic()))
+    return {"admitted": admitted, "retry_after": lane.retry_after()}
+
+async def handle_listener_ipc_connection(reader, writer):
+    """
+    Serve listener operations for a web worker connected to the daemon socket
+    """
+    def write_frame(kind, payload):
+        writer.write(kind + struct.pack('>I', len(payload)) + payload)
+    
+    # Admission slots taken by the worker are held until it disconnects
+    held_slots = []
+    
+    try:
+        while True:
+            try:
+                header = await reader.readexactly(4)
+            except asyncio.IncompleteReadError:
+                break
+            
+            length = struct.unpack('>I', header)[0]
+            if length > LISTENER_MAX_REQUEST_BYTES:
+                # The oversized body is not read, so the connection cannot be reused
+                write_frame(b'E', f"Listener daemon error: request of {length} bytes exceeds the {LISTENER_MAX_REQUEST_BYTES} byte limit".encode('utf-8'))
+                await writer.drain()
+                break
+            
+            try:
+                call = json.loads(await reader.readexactly(length))
+                if call.get('op') == 'admit':
+                    result = await admit_worker_request(call['args']['lane'], held_slots)
+                else:
+                    handler = LISTENER_IPC_OPS.get(call.get('op'))
+                    if handler is None:
+                        raise ValueError(f"Unknown listener operation: {call.get('op')}")
+                    result = await handler(**call.get('args', {}))
+                if isinstance(result, bytes):
+                    kind, payload = b'R', result
+                else:
+                    kind, payload = b'J', dumps_json_bytes(result)
+            except Exception as e:
+                kind, payload = b'E', f"Listener daemon error: {e}".encode('utf-8')
+            
+            write_frame(kind, payload)
+            await writer.drain()
+    except Exception as e:
+        print(f"Error in listener IPC connection: {e}")
+    finally:
+        for lane, admitted_at in held_slots:
+            lane.release(time.monotonic() - admitted_at)
+        writer.close()
+
+async def serve_listener_daemon():
+    """
+    Run the message listener and serve its state over the listener socket
+    """
+    if not await start_message_listener():
+        return False
+    
+    start_entity_cache_warmup()
+    
+    # Remove a stale socket left behind by a previous run
+    if os.path.exists(LISTENER_SOCKET):
+        os.unlink(LISTENER_SOCKET)
+    
+    # Create the socket owner-only from the start rather than restricting it after binding
+    previous_umask = os.umask(0o177)
+    try:
+        server = await asyncio.start_unix_server(handle_listener_ipc_connection, path=LISTENER_SOCKET)
+    finally:
+        os.umask(previous_umask)
+    print(f"Listener daemon serving on {LISTENER_SOCKET}")
+    
+    async with server:
+        # Keep the client running indefinitely
+        while listener_running:
+            await asyncio.sleep(1)
+    
+    return True
+
+def run_listener_daemon():
+    """
+    Run this process as the listener daemon shared by all web workers
+    """
+    global is_listener_daemon
+    global listener_thread_id
+    
+    if not LISTENER_SOCKET:
+        print("LISTENER_SOCKET must be set to run the listener daemon")
+        sys.exit(1)
+    
+    is_listener_daemon = True
+    listener_thread_id = threading.get_ident()
+    asyncio.run(serve_listener_daemon())
+
+@app.before_request
+def start_request_trace():
+    """
+    Start tracing the request and mark its thread for profiling
+    """
+    g.trace_token = request_trace.set(RequestTrace())
+    active_request_threads.add(threading.get_ident())
+    
+    # Web workers without a local listener (e.g. under gunicorn) warm up on their first request
+    start_entity_cache_warmup_in_background()
+
+def has_admin_token():
+    """
+    Check whether the request carries the ADMIN_TOKEN in its X-Admin-Token header
+    """
+    if not ADMIN_TOKEN:
+        return False
+    provided_token = request.headers.get('X-Admin-Token', '')
+    return hmac.compare_digest(provided_token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
+
+def trace_requested():
+    """
+    Check whether the request's trace should be reported
+    
+    Timings reveal internals, so the X-Debug-Trace header is only honoured on
+    requests that also carry the admin token.
+    """
+    if TRACE_REQUESTS:
+        return True
+    if request.headers.get('X-Debug-Trace', '').lower() not in ('1', 'true', 'yes'):
+        return False
+    return has_admin_token()
+
+@app.after_request
+def report_request_trace(response):
+    """
+    Report the request's trace spans when tracing is enabled
+    """
+    trace = request_trace.get()
+    if trace is None or not trace_requested():
+        return response
+    
+    summary = f"{request.method} {request.path} {response.status_code}"
+    if response.is_streamed:
+        # Headers go out before the body runs, so log the full trace once the stream closes
+        response.call_on_close(lambda: print(f"[trace] {summary} {trace.log_line()}"))
+    else:
+        response.headers['Server-Timing'] = trace.server_timing()
+        print(f"[trace] {summary} {trace.log_line()}")
+    return response
+
+@app.teardown_request
+def end_request_trace(exc):
+    active_request_threads.discard(threading.get_ident())
+    token = g.pop('trace_token', None)
+    if token is not None:
+        request_trace.reset(token)
+
+def rejected_response(error):
     """
-    Run the message listener in a background thread
+    Build the 429 response for a saturated admission lane
     """
-    async def _run_listener():
-        success = await start_message_listener()
-        if success:
-            # Keep the client running indefinitely
-            while listener_running:
-                await asyncio.sleep(1)
-    
-    # Run in a new thread
-    def _thread_target():
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(_run_listener())
+    response = jsonify({"error": str(error)})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def admission_controlled(lane_name):
+    """
+    Admit requests to a view through an admission lane, answering 429 when it is saturated
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                with trace_span(f"admission.{lane_name}"):
+                    release = acquire_admission(lane_name)
+            except AdmissionRejectedError as e:
+                return rejected_response(e)
+            except ListenerDaemonError as e:
+                return jsonify({"error": str(e)}), 503
+            
+            token = held_admission_lane.set(lane_name)
+            try:
+                response = app.make_response(view(*args, **kwargs))
+            except AdmissionRejectedError as e:
+                # A join inside the request could not get a write slot
+                release()
+                return rejected_response(e)
+            except Exception:
+                release()
+                raise
+            finally:
+                held_admission_lane.reset(token)
+            
+            # Streamed responses keep their slot until the stream is closed
+            if response.is_streamed:
+                response.call_on_close(release)
+            else:
+                release()
+            return response
+        
+        return wrapper
     
-    thread = threading.Thread(target=_thread_target)
-    thread.daemon = True  # Thread will exit when the main program exits
-    thread.start()
-    return thread
+    return decorator
 
 @app.route('/create-telegram-group', methods=['POST'])
+@admission_controlled('write')
 def create_group():
     """
     API endpoint to create a Telegram group and invite users
@@ -455,13 +1958,16 @@ def create_group():
     # Run the async function
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
-    result, status_code = loop.run_until_complete(process_request())
-    loop.close()
+    try:
+        result, status_code = loop.run_until_complete(process_request())
+    finally:
+        loop.close()
     
     # Return the result
     return jsonify(result), status_code
 
 @app.route('/send-telegram-group-message', methods=['POST'])
+@admission_controlled('write')
 def send_group_message():
     """
     API endpoint to send a message to a Telegram group
@@ -532,13 +2038,16 @@ def send_group_message():
     # Run the async function
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
-    result, status_code = loop.run_until_complete(process_request())
-    loop.close()
+    try:
+        result, status_code = loop.run_until_complete(process_request())
+    finally:
+        loop.close()
     
     # Return the result
     return jsonify(result), status_code
 
 @app.route('/listen-to-group', methods=['POST'])
+@admission_controlled('read')
 def listen_to_group():
     """
     API endpoint to start listening to messages in a Telegram group
@@ -576,25 +2085,26 @@ def listen_to_group():
     # Create async function to handle the process
     async def process_request():
         # Make sure the listener is running
-        global listener_running
-        if not listener_running:
-            # Start the listener in a background thread
-            run_listener_in_background()
-            # Wait for the listener to start
-            for _ in range(5):  # Wait up to 5 seconds
-                if listener_running:
-                    break
-                await asyncio.sleep(1)
+        try:
+            running = await ensure_listener_running()
+        except ListenerDaemonError as e:
+            return {"error": str(e)}, 503
         
-        if not listener_running:
+        if not running:
             return {"error": "Failed to start message listener"}, 500
         
         results = []
         errors = []
+        rejection = None
         
         # Add each group to the listeners
         for group_link in group_links:
-            group_entity, error = await add_group_to_listeners(group_link)
+            try:
+                group_entity, error = await add_group_to_listeners(group_link)
+            except AdmissionRejectedError as e:
+                # Groups added before the rejection stay registered, so report it per link
+                rejection = e
+                group_entity, error = None, str(e)
             
             if error:
                 errors.append({
@@ -608,6 +2118,9 @@ def listen_to_group():
                     "link": group_link
                 })
         
+        if rejection is not None and not results:
+            raise rejection
+        
         # Return the result
         return {
             "success": len(results) > 0,
@@ -619,13 +2132,16 @@ def listen_to_group():
     # Run the async function
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
-    result, status_code = loop.run_until_complete(process_request())
-    loop.close()
+    try:
+        result, status_code = loop.run_until_complete(process_request())
+    finally:
+        loop.close()
     
     # Return the result
     return jsonify(result), status_code
 
 @app.route('/get-group-messages', methods=['POST'])
+@admission_controlled('read')
 def get_group_messages():
     """
     API endpoint to get messages from a Telegram group
@@ -662,7 +2178,7 @@ def get_group_messages():
             
             # Check if we're listening to this group
             group_id = group_entity.id
-            if group_id not in active_listeners:
+            if not await is_group_listened(group_id):
                 # Add it to listeners if not already listening
                 await add_group_to_listeners(group_link)
                 return {
@@ -677,31 +2193,36 @@ def get_group_messages():
                 }, 200
             
             # Get messages for this group
-            messages = message_history.get(group_id, [])
+            messages_payload = await get_group_messages_payload(group_id)
             
-            # Return the result
-            return {
-                "success": True,
-                "group": {
-                    "id": group_id,
-                    "title": group_entity.title,
-                    "link": group_link
-                },
-                "messages": messages
-            }, 200
+            # Return the result, concatenating the pre-serialized messages
+            return build_group_messages_response({
+                "id": group_id,
+                "title": group_entity.title,
+                "link": group_link
+            }, messages_payload), 200
+        except ListenerDaemonError as e:
+            return {"error": str(e)}, 503
         finally:
             await client.disconnect()
     
     # Run the async function
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
-    result, status_code = loop.run_until_complete(process_request())
-    loop.close()
+    try:
+        result, status_code = loop.run_until_complete(process_request())
+    finally:
+        loop.close()
+    
+    # Already serialized history responses are returned as-is
+    if isinstance(result, bytes):
+        return app.response_class(result, status=status_code, mimetype='application/json')
     
     # Return the result
     return jsonify(result), status_code
 
 @app.route('/stop-listening', methods=['POST'])
+@admission_controlled('read')
 def stop_listening():
     """
     API endpoint to stop listening to messages in a Telegram group
@@ -736,20 +2257,9 @@ def stop_listening():
             if error:
                 return {"error": error}, 500
             
-            # Check if we're listening to this group
+            # Stop listening to this group if we were
             group_id = group_entity.id
-            if group_id in active_listeners:
-                # Remove from active listeners
-                del active_listeners[group_id]
-                
-                # Clear message history for this group
-                if group_id in message_history:
-                    del message_history[group_id]
-                
-                # If no more active listeners, stop the listener
-                if not active_listeners and listener_running:
-                    await stop_message_listener()
-                
+            if await unregister_group_listener(group_id):
                 return {
                     "success": True,
                     "message": f"Stopped listening to group: {group_entity.title}"
@@ -759,22 +2269,391 @@ def stop_listening():
                     "success": False,
                     "message": "Not listening to this group"
                 }, 400
+        except ListenerDaemonError as e:
+            return {"error": str(e)}, 503
+        finally:
+            await client.disconnect()
+    
+    # Run the async function
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        result, status_code = loop.run_until_complete(process_request())
+    finally:
+        loop.close()
+    
+    # Return the result
+    return jsonify(result), status_code
+
+@app.route('/set-group-rules', methods=['POST'])
+@admission_controlled('read')
+def set_rules():
+    """
+    API endpoint to set the message rules of a listened Telegram group
+    
+    Expected JSON input:
+    {
+        "group_link": "https://t.me/+abcdef123456",
+        "rules": [
+            {
+                "name": "price",
+                "keywords": ["fiyat", "indirim"],
+                "regex": "\\d+ ?TL",
+                "sender_ids": [123456789],
+                "has_media": false
+            }
+        ],
+        "only_matches": false
+    }
+    
+    An empty rules list removes the group's rules.
+    """
+    # Get request data
+    data = request.json
+    
+    # Validate input
+    if not data:
+        return jsonify({"error": "No data provided"}), 400
+    
+    if 'group_link' not in data:
+        return jsonify({"error": "group_link is required"}), 400
+    
+    if 'rules' not in data:
+        return jsonify({"error": "rules is required"}), 400
+    
+    group_link = data['group_link']
+    rules = data['rules']
+    only_matches = bool(data.get('only_matches', False))
+    
+    # Validate the rules before touching Telegram
+    rule_set, error = compile_group_rules(rules, only_matches)
+    if error:
+        return jsonify({"error": error}), 400
+    
+    # Create async function to handle the process
+    async def process_request():
+        # Create a temporary client
+        client = await create_client_for_request()
+        if not client:
+            return {"error": "Failed to initialize client"}, 500
+        
+        try:
+            # Get the group entity
+            group_entity, error = await extract_group_entity_from_link(client, group_link)
+            if error:
+                return {"error": error}, 500
+            
+            error = await set_group_rules(group_entity.id, rules, only_matches)
+            if error:
+                return {"error": error}, 400
+            
+            return {
+                "success": True,
+                "group": {
+                    "id": group_entity.id,
+                    "title": group_entity.title,
+                    "link": group_link
+                },
+                "rules": len(rule_set.rules),
+                "only_matches": only_matches
+            }, 200
+        except ListenerDaemonError as e:
+            return {"error": str(e)}, 503
+        finally:
+            await client.disconnect()
+    
+    # Run the async function
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        result, status_code = loop.run_until_complete(process_request())
+    finally:
+        loop.close()
+    
+    # Return the result
+    return jsonify(result), status_code
+
+@app.route('/group-stats', methods=['POST'])
+@admission_controlled('read')
+def group_stats_endpoint():
+    """
+    API endpoint to get streaming message statistics of a listened Telegram group
+    
+    Expected JSON input:
+    {
+        "group_link": "https://t.me/+abcdef123456"
+    }
+    """
+    # Get request data
+    data = request.json
+    
+    # Validate input
+    if not data:
+        return jsonify({"error": "No data provided"}), 400
+    
+    if 'group_link' not in data:
+        return jsonify({"error": "group_link is required"}), 400
+    
+    group_link = data['group_link']
+    
+    # Create async function to handle the process
+    async def process_request():
+        # Create a temporary client
+        client = await create_client_for_request()
+        if not client:
+            return {"error": "Failed to initialize client"}, 500
+        
+        try:
+            # Get the group entity
+            group_entity, error = await extract_group_entity_from_link(client, group_link)
+            if error:
+                return {"error": error}, 500
+            
+            stats = await get_group_stats(group_entity.id)
+            if stats is None:
+                return {
+                    "success": False,
+                    "message": "Not listening to this group"
+                }, 400
+            
+            return {
+                "success": True,
+                "group": {
+                    "id": group_entity.id,
+                    "title": group_entity.title,
+                    "link": group_link
+                },
+                "stats": stats
+            }, 200
+        except ListenerDaemonError as e:
+            return {"error": str(e)}, 503
         finally:
             await client.disconnect()
     
     # Run the async function
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
-    result, status_code = loop.run_until_complete(process_request())
-    loop.close()
+    try:
+        result, status_code = loop.run_until_complete(process_request())
+    finally:
+        loop.close()
+    
+    # Return the result
+    return jsonify(result), status_code
+
+@app.route('/export-group-history', methods=['POST'])
+@admission_controlled('export')
+def export_group_history():
+    """
+    API endpoint to stream the full message history of a Telegram group as NDJSON
+    
+    Expected JSON input:
+    {
+        "group_link": "https://t.me/+abcdef123456",
+        "batch_size": 100,
+        "cursor": 1001,
+        "compress": false
+    }
+    
+    Messages are streamed from newest to oldest. To resume an interrupted export,
+    pass the id of the last received message as cursor.
+    """
+    # Get request data
+    data = request.json
+    
+    # Validate input
+    if not data:
+        return jsonify({"error": "No data provided"}), 400
+    
+    if 'group_link' not in data:
+        return jsonify({"error": "group_link is required"}), 400
+    
+    try:
+        batch_size = int(data.get('batch_size', 100))
+        cursor = int(data['cursor']) if data.get('cursor') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "batch_size and cursor must be integers"}), 400
+    
+    if not 1 <= batch_size <= 100:
+        return jsonify({"error": "batch_size must be between 1 and 100"}), 400
+    
+    group_link = data['group_link']
+    compress = bool(data.get('compress', False))
+    
+    # Resolve the group before streaming so errors still get a proper status code
+    async def open_export():
+        client = await create_client_for_request()
+        if not client:
+            return None, None, ({"error": "Failed to initialize client"}, 500)
+        
+        try:
+            group_entity, error = await extract_group_entity_from_link(client, group_link)
+        except AdmissionRejectedError:
+            await client.disconnect()
+            raise
+        if error:
+            await client.disconnect()
+            return None, None, ({"error": error}, 500)
+        
+        return client, group_entity, None
+    
+    # The loop stays open for the lifetime of the stream
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        client, group_entity, failure = loop.run_until_complete(open_export())
+    except Exception:
+        loop.close()
+        raise
+    if failure:
+        loop.close()
+        result, status_code = failure
+        return jsonify(result), status_code
+    
+    # The request's trace is reset at teardown, before the body is streamed
+    trace = request_trace.get()
+    
+    def generate():
+        request_trace.set(trace)
+        compressor = zlib.compressobj(wbits=31) if compress else None  # gzip container
+        pages = iter_group_history_pages(client, group_entity, batch_size, cursor)
+        
+        def encode(chunk):
+            if compressor:
+                # Sync flush so every batch reaches the client right away
+                return compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            return chunk
+        
+        try:
+            try:
+                while True:
+                    try:
+                        chunk = loop.run_until_complete(pages.__anext__())
+                    except StopAsyncIteration:
+                        break
+                    yield encode(chunk)
+            except Exception as e:
+                # Headers are already sent, so report the failure as a final record
+                print(f"Error exporting group history: {e}")
+                yield encode(dumps_json_bytes({"error": f"Error exporting group history: {e}"}) + b'\n')
+            
+            if compressor:
+                yield compressor.flush()
+        finally:
+            loop.run_until_complete(pages.aclose())
+            loop.run_until_complete(client.disconnect())
+            loop.close()
+            request_trace.set(None)
+    
+    response = app.response_class(generate(), status=200, mimetype='application/x-ndjson')
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+@app.route('/health', methods=['GET'])
+def health():
+    """
+    API endpoint reporting listener state, warm-up progress and listened groups
+    
+    Returns 200 once the entity cache warm-up is over (and the listener daemon is
+    reachable, if used) and 503 otherwise, so it can be used as a readiness probe.
+    """
+    # Create async function to handle the process
+    async def process_request():
+        try:
+            result = await get_health()
+        except ListenerDaemonError as e:
+            return {"status": "listener_unavailable", "ready": False, "error": str(e)}, 503
+        
+        return result, 200 if result["ready"] else 503
+    
+    # Run the async function
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        result, status_code = loop.run_until_complete(process_request())
+    finally:
+        loop.close()
+    
+    # Return the result
+    return jsonify(result), status_code
+
+@app.route('/admin/profile', methods=['POST'])
+def admin_profile():
+    """
+    API endpoint to sample-profile the request or listener threads for a few seconds
+    
+    Requires the X-Admin-Token header to match ADMIN_TOKEN.
+    
+    Expected JSON input:
+    {
+        "target": "listener",
+        "seconds": 10
+    }
+    
+    The profile is written in folded format (usable with flamegraph tools)
+    to PROFILE_DIR once sampling finishes.
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Admin endpoints are disabled, set ADMIN_TOKEN to enable them"}), 403
+    
+    if not has_admin_token():
+        return jsonify({"error": "Invalid admin token"}), 403
+    
+    # Get request data
+    data = request.json or {}
+    
+    target = data.get('target', 'requests')
+    if target not in ('requests', 'listener'):
+        return jsonify({"error": "target must be 'requests' or 'listener'"}), 400
+    
+    try:
+        seconds = float(data.get('seconds', 10))
+    except (TypeError, ValueError):
+        return jsonify({"error": "seconds must be a number"}), 400
+    
+    if not 0 < seconds <= 300:
+        return jsonify({"error": "seconds must be between 0 and 300"}), 400
+    
+    # Create async function to handle the process
+    async def process_request():
+        try:
+            output_path, error = await start_profiling(target, seconds)
+        except ListenerDaemonError as e:
+            return {"error": str(e)}, 503
+        
+        if error:
+            return {"error": error}, 409
+        
+        return {
+            "success": True,
+            "target": target,
+            "seconds": seconds,
+            "output": output_path,
+            "message": f"Profiling {target} for {seconds} seconds"
+        }, 200
+    
+    # Run the async function
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        result, status_code = loop.run_until_complete(process_request())
+    finally:
+        loop.close()
     
     # Return the result
     return jsonify(result), status_code
 
 # Initialize the message listener when the app starts
 if __name__ == '__main__':
-    # Start the message listener in a background thread
-    run_listener_in_background()
+    # Run as the shared listener daemon instead of the web app
+    if '--listener-daemon' in sys.argv:
+        run_listener_daemon()
+        sys.exit(0)
+    
+    # Start the message listener in a background thread unless a daemon owns it
+    if not LISTENER_SOCKET:
+        run_listener_in_background()
     
     # Run Flask app
     app.run(debug=True, port=5000)
\ No newline at end of file
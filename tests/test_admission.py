@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("telethon")
+
+from telegram_api import AdmissionLane, AdmissionRejectedError, acquire_admission, admission_lanes
+
+
+def test_lane_admits_up_to_capacity_without_waiting():
+    lane = AdmissionLane("test", capacity=2, max_waiting=0, wait_seconds=1)
+    assert lane.acquire()
+    assert lane.acquire()
+    assert not lane.acquire()
+    lane.release(0.1)
+    assert lane.acquire()
+
+
+def test_lane_rejects_when_queue_is_full():
+    lane = AdmissionLane("test", capacity=1, max_waiting=1, wait_seconds=5)
+    assert lane.acquire()
+
+    waiter_admitted = []
+    waiter = threading.Thread(target=lambda: waiter_admitted.append(lane.acquire()))
+    waiter.start()
+    while lane.waiting == 0:
+        pass
+
+    # The only queue place is taken, so this fails fast instead of waiting
+    assert not lane.acquire()
+
+    lane.release(0.1)
+    waiter.join()
+    assert waiter_admitted == [True]
+
+
+def test_lane_rejects_after_waiting_too_long():
+    lane = AdmissionLane("test", capacity=1, max_waiting=1, wait_seconds=0.05)
+    assert lane.acquire()
+    assert not lane.acquire()
+    assert lane.waiting == 0
+
+
+def test_retry_after_grows_with_queue():
+    lane = AdmissionLane("test", capacity=1, max_waiting=4, wait_seconds=1)
+    lane.acquire()
+    lane.release(10)
+    assert lane.retry_after() == 3
+    lane.waiting = 2
+    assert lane.retry_after() == 9
+
+
+def test_acquire_admission_raises_with_retry_after(monkeypatch):
+    lane = AdmissionLane("write", capacity=1, max_waiting=0, wait_seconds=1)
+    monkeypatch.setattr("telegram_api.LISTENER_SOCKET", None)
+    monkeypatch.setitem(admission_lanes, "write", lane)
+
+    release = acquire_admission("write")
+    with pytest.raises(AdmissionRejectedError) as rejected:
+        acquire_admission("write")
+    assert rejected.value.lane_name == "write"
+    assert rejected.value.retry_after >= 1
+
+    release()
+    assert lane.in_flight == 0
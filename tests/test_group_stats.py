@@ -0,0 +1,66 @@
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("telethon")
+
+from telegram_api import GroupStats, HyperLogLog, RollingRateCounter, SpaceSavingTopK
+
+
+def test_rolling_counter_drops_buckets_outside_the_window():
+    counter = RollingRateCounter(window_seconds=300, bucket_seconds=60)
+    counter.add(0)
+    counter.add(30)
+    counter.add(120)
+    assert counter.count(300, now=200) == 3
+    assert counter.count(60, now=150) == 1
+
+    # Bucket 5 reuses the slot of bucket 0 once the window has moved past it
+    counter.add(300)
+    assert counter.count(300, now=310) == 2
+    assert counter.count(300, now=900) == 0
+
+
+def test_rolling_counter_ignores_timestamps_older_than_the_slot():
+    counter = RollingRateCounter(window_seconds=300, bucket_seconds=60)
+    counter.add(300)
+    counter.add(0)
+    assert counter.count(300, now=310) == 1
+
+
+def test_top_k_evicts_the_smallest_counter():
+    top_k = SpaceSavingTopK(capacity=2)
+    for key in ["a", "a", "a", "b", "b", "c"]:
+        top_k.add(key)
+    assert top_k.top() == [
+        {"id": "a", "label": None, "count": 3, "max_error": 0},
+        {"id": "c", "label": None, "count": 3, "max_error": 2},
+    ]
+
+
+def test_top_k_keeps_heavy_hitters():
+    top_k = SpaceSavingTopK(capacity=10)
+    for i in range(1000):
+        top_k.add("heavy")
+        top_k.add(f"light_{i}")
+    assert top_k.top(1)[0]["id"] == "heavy"
+
+
+@pytest.mark.parametrize("cardinality", [100, 10000, 100000])
+def test_hyperloglog_estimate_is_close(cardinality):
+    hll = HyperLogLog()
+    for i in range(cardinality):
+        hll.add(i)
+        hll.add(i)
+    assert abs(hll.estimate() - cardinality) <= cardinality * 0.05
+
+
+def test_group_stats_skip_missing_sender():
+    stats = GroupStats()
+    stats.add(100, None, None, True)
+    stats.add(50, 7, "user", False)
+    summary = stats.summary()
+    assert summary["total_messages"] == 2
+    assert summary["media_messages"] == 1
+    assert summary["unique_senders_estimate"] == 1
+    assert [sender["id"] for sender in summary["top_senders"]] == [7]
+    assert summary["first_message_at"].startswith("1970-01-01T00:00:50")
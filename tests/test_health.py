@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("telethon")
+
+import telegram_api
+from telegram_api import get_health, start_entity_cache_warmup_in_background
+
+
+@pytest.fixture(autouse=True)
+def local_listener(monkeypatch):
+    monkeypatch.setattr(telegram_api, "LISTENER_SOCKET", None)
+    monkeypatch.setattr(telegram_api, "WARMUP_DIALOGS", True)
+    monkeypatch.setattr(telegram_api, "warmup_state", {
+        "state": "pending", "dialogs": 0, "duration_ms": None, "error": None
+    })
+
+
+@pytest.mark.parametrize("state, status, ready", [
+    ("pending", "warming_up", False),
+    ("running", "warming_up", False),
+    ("done", "ok", True),
+    ("failed", "failed", True),
+])
+def test_health_reports_warmup_state(state, status, ready):
+    telegram_api.warmup_state["state"] = state
+    health = asyncio.run(get_health())
+    assert health["status"] == status
+    assert health["ready"] is ready
+
+
+def test_requests_leave_the_warmup_to_a_starting_listener(monkeypatch):
+    monkeypatch.setattr(telegram_api, "listener_starting", True)
+    start_entity_cache_warmup_in_background()
+    assert telegram_api.warmup_state["state"] == "pending"
@@ -0,0 +1,90 @@
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("telethon")
+
+from telegram_api import compile_group_rules
+
+
+def compile_rules(rules, only_matches=False):
+    rule_set, error = compile_group_rules(rules, only_matches)
+    assert error is None
+    return rule_set
+
+
+def test_overlapping_keyword_and_regex_both_match():
+    rule_set = compile_rules([
+        {"name": "a", "keywords": ["price"]},
+        {"name": "b", "regex": r"price \d+"},
+    ])
+    assert rule_set.match("price 100", 1, False) == ["a", "b"]
+
+
+def test_overlapping_keywords_both_match():
+    rule_set = compile_rules([
+        {"name": "short", "keywords": ["fiyat"]},
+        {"name": "long", "keywords": ["fiyatlar"]},
+    ])
+    assert rule_set.match("Fiyatlar düştü", 1, False) == ["long", "short"]
+
+
+def test_shared_keyword_matches_every_rule():
+    rule_set = compile_rules([
+        {"name": "a", "keywords": ["Sale"]},
+        {"name": "b", "keywords": ["sale"]},
+    ])
+    assert rule_set.match("big SALE", 1, False) == ["a", "b"]
+
+
+def test_all_conditions_of_a_rule_must_hold():
+    rule_set = compile_rules([
+        {"name": "price", "keywords": ["fiyat", "indirim"], "regex": r"\d+ ?TL", "sender_ids": [1]},
+    ])
+    assert rule_set.match("fiyat", 1, False) == []
+    assert rule_set.match("indirim 50 TL", 2, False) == []
+    assert rule_set.match("indirim 50 TL", 1, False) == ["price"]
+
+
+def test_textless_rules_match_on_sender_and_media():
+    rule_set = compile_rules([{"name": "media", "sender_ids": [7], "has_media": True}])
+    assert rule_set.match(None, 7, True) == ["media"]
+    assert rule_set.match("hello", 7, False) == []
+
+
+def test_regexes_are_compiled_independently():
+    rule_set = compile_rules([
+        {"name": "a", "regex": r"(?P<n>\d)"},
+        {"name": "b", "regex": r"(?P<n>\d)x"},
+        {"name": "repeat", "regex": r"(\w)\1"},
+        {"name": "flags", "regex": r"(?i)hello"},
+    ])
+    assert rule_set.match("HELLO 1x", 1, False) == ["a", "b", "flags", "repeat"]
+
+
+def test_invalid_regex_is_rejected():
+    rule_set, error = compile_group_rules([{"name": "bad", "regex": r"(\w)\2"}])
+    assert rule_set is None
+    assert "Invalid regex in rule bad" in error
+
+
+def test_gated_regexes_match_only_their_own_rules():
+    rule_set = compile_rules([
+        {"name": "amount", "regex": r"\d+ ?TL"},
+        {"name": "code", "regex": r"[A-Z]{3}-\d{3}"},
+        {"name": "grouped", "regex": r"(ab)+"},
+    ])
+    assert rule_set.regex_gate is not None
+    assert rule_set.match("50 TL", 1, False) == ["amount"]
+    assert rule_set.match("ABC-123 abab", 1, False) == ["code", "grouped"]
+    assert rule_set.match("nothing here", 1, False) == []
+
+
+@pytest.mark.parametrize("rule, message", [
+    ({"name": "r", "regex": 5}, "regex of rule r must be a string"),
+    ({"name": "m", "has_media": "false"}, "has_media of rule m must be true or false"),
+    ({"name": "s", "sender_ids": []}, "sender_ids of rule s must not be empty"),
+])
+def test_malformed_conditions_are_rejected(rule, message):
+    rule_set, error = compile_group_rules([rule])
+    assert rule_set is None
+    assert error == message
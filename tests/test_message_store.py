@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("telethon")
+
+import telegram_api
+from telegram_api import (
+    delete_message_records,
+    message_history,
+    store_message_record,
+    unregister_group_listener,
+    unscoped_message_index,
+    update_message_record,
+)
+
+
+@pytest.fixture(autouse=True)
+def empty_store(monkeypatch):
+    monkeypatch.setattr(telegram_api, "LISTENER_SOCKET", None)
+    monkeypatch.setattr(telegram_api, "MESSAGE_HISTORY_LIMIT", 3)
+    message_history.clear()
+    unscoped_message_index.clear()
+    yield
+    message_history.clear()
+    unscoped_message_index.clear()
+
+
+def test_oldest_messages_are_evicted_with_their_index_entries():
+    for message_id in range(1, 6):
+        store_message_record(10, message_id, b"{}", unscoped=True)
+    assert list(message_history[10]) == [3, 4, 5]
+    assert unscoped_message_index == {3: 10, 4: 10, 5: 10}
+
+
+def test_eviction_keeps_index_entries_owned_by_another_group():
+    store_message_record(10, 1, b"{}", unscoped=True)
+    store_message_record(20, 1, b"{}", unscoped=True)
+    for message_id in range(2, 5):
+        store_message_record(10, message_id, b"{}")
+    assert 1 not in message_history[10]
+    assert unscoped_message_index == {1: 20}
+
+
+def test_update_keeps_position_and_ignores_unknown_messages():
+    for message_id in range(1, 4):
+        store_message_record(10, message_id, b"old")
+    assert update_message_record(10, 1, b"new")
+    assert not update_message_record(10, 99, b"new")
+    assert list(message_history[10].items()) == [(1, b"new"), (2, b"old"), (3, b"old")]
+
+
+def test_unscoped_deletion_uses_the_id_index():
+    store_message_record(10, 1, b"{}", unscoped=True)
+    store_message_record(10, 2, b"{}", unscoped=True)
+    assert delete_message_records(None, [1, 42]) == 1
+    assert list(message_history[10]) == [2]
+    assert unscoped_message_index == {2: 10}
+
+
+def test_unregister_drops_history_and_index_entries(monkeypatch):
+    monkeypatch.setitem(telegram_api.active_listeners, 10, "https://t.me/group")
+    store_message_record(10, 1, b"{}", unscoped=True)
+    store_message_record(20, 2, b"{}", unscoped=True)
+
+    assert asyncio.run(unregister_group_listener(10))
+    assert 10 not in message_history
+    assert unscoped_message_index == {2: 20}